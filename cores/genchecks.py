@@ -15,12 +15,17 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import os, shutil, re, argparse
-from functools import reduce
+from multiprocessing import Pool
+from functools import lru_cache, partial
 from dataclasses import dataclass, field
-from typing import Any, Tuple, Dict, List, Optional, Set, Union
+from typing import Any, Tuple, Dict, FrozenSet, Iterable, List, Optional, Set, Union
 
 
-Config = Dict[str, List[Union[str, Tuple[List[str], str]]]]
+Config = Dict[str, Union[List[Union[str, Tuple[Any, ...], re.Pattern]], "DepthRules"]]
+
+# split by spaces, unless those spaces are inside quotation marks
+_CSR_TEST_RE  = re.compile(r"((?:\S*?\"[^\"]*\")+|\S+)")
+_HFMT_SUB_RE  = re.compile(r"@([a-zA-Z0-9_]+)@")
 
 @dataclass
 class ISAConfig():
@@ -43,7 +48,7 @@ class ISAConfig():
         # use regex to split by spaces, unless those spaces are inside quotation marks
         # e.g. const="32'h dead_beef" is one match not two
         #      const="32'h 0"_mask="32'h dead_beef" is also one match
-        tests = re.findall(r"((?:\S*?\"[^\"]*\")+|\S+)", test_str)
+        tests = _CSR_TEST_RE.findall(test_str)
         self.csr_tests[csr_name] = tests
 
     def add_csr(self, csr_str: str) -> str:
@@ -56,10 +61,22 @@ class ISAConfig():
         return name
 
 def mask_bits(test: str, bits: List[int], mask_len: int, invert=False) -> str:
-    mask = reduce(lambda x, y: x | 1<<y, bits, 0)
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
     fstring = f"{test}_mask={'~' if invert else ''}{mask_len}'b{{:0{mask_len}b}}"
     return fstring.format(mask)
 
+# the reserved bit masks of the 1.12 spec csrs only depend on xlen
+def _mstatus_mask(xlen: int) -> str:
+    return mask_bits("zero", [0, 2, 4, *range(23, 31)] + ([31, *range(38, 63)] if xlen==64 else []), xlen)
+
+def _mstatush_mask(xlen: int) -> str:
+    return mask_bits("zero", [4, 5], xlen, invert=True)
+
+def _misa_mask(xlen: int) -> str:
+    return mask_bits("zero", [6, 10, 11, 14, 17, 19, 22, 24, 25, *range(26, xlen-2)], xlen)
+
 @dataclass
 class SolverConfig():
     solver:       str = "boolector"
@@ -79,11 +96,39 @@ class PathConfig():
     corename: str
     cfgname:  str           = CFGNAME
     basedir:  str           = BASEDIR
+    incremental: bool       = False
 
 
+@dataclass
+class DepthRules():
+    # rules naming a single check, mapped to their (rule index, depths)
+    literal:  Dict[str, Tuple[int, List[int]]]          = field(default_factory=dict)
+    # rules matching checks by regex, as (rule index, pattern, depths)
+    regex:    List[Tuple[int, re.Pattern, List[int]]]   = field(default_factory=list)
+    # maps a check name to the last rule it matched and its depths, filled in by lookup
+    # (each worker process fills its own copy)
+    cache:    Dict[str, Tuple[int, Optional[List[int]]]] = field(default_factory=dict)
+
+    def lookup(self, pat: str) -> Tuple[int, Optional[List[int]]]:
+        if pat not in self.cache:
+            ret = self.literal.get(pat, (-1, None))
+            for (idx, cre, depths) in reversed(self.regex):
+                if idx < ret[0]:
+                    break
+                if cre.fullmatch(pat):
+                    ret = (idx, depths)
+                    break
+            self.cache[pat] = ret
+        return self.cache[pat]
+
+
+# sections whose lines are only ever used as whitespace separated tokens
+TOKENIZED_SECTIONS: Set[str] = {"options", "depth", "filter-checks", "illegal_csrs"}
+
 def parse_cfg(cfg_path: str) -> Config:
 
-    # config maps section names to lines or tuples of a subsection name and its line
+    # config maps section names to lines or tuples of compiled subsection patterns and a line,
+    # lines of tokenized sections are stored pre-split into tuples of tokens
     config = {}
 
     print(f"Reading {cfg_path}.cfg.")
@@ -102,7 +147,7 @@ def parse_cfg(cfg_path: str) -> Config:
                 cfgsection = line.lstrip("[").rstrip("]")
                 cfgsubsection = None
                 if cfgsection.startswith("assume ") or cfgsection == "assume":
-                    cfgsubsection = cfgsection.split()[1:]
+                    cfgsubsection = parse_assume_patterns(cfgsection.split()[1:])
                     cfgsection = "assume"
                 continue
 
@@ -111,14 +156,57 @@ def parse_cfg(cfg_path: str) -> Config:
                 if cfgsection not in config:
                     config[cfgsection] = []
 
-                if cfgsubsection is None:
+                if cfgsection in TOKENIZED_SECTIONS:
+                    config[cfgsection].append(tuple(line.split()))
+                elif cfgsubsection is None:
                     config[cfgsection].append(line)
                 else:
                     config[cfgsection].append((cfgsubsection, line))
 
+    # depth, filter and sort rules are matched against every generated check, so compile them once up front
+    if "depth" in config:
+        config["depth"] = parse_depth_rules(config["depth"])
+
+    if "filter-checks" in config:
+        config["filter-checks"] = parse_filter_rules(config["filter-checks"])
+
+    if "sort" in config:
+        config["sort"] = [re.compile(line) for line in config["sort"]]
+
     return config
 
 
+def parse_depth_rules(lines: List[Tuple[str, ...]]) -> DepthRules:
+    rules = DepthRules()
+    for idx, line in enumerate(lines):
+        assert isinstance(line, tuple)
+        if len(line) == 0:
+            continue
+        depths = [int(s) for s in line[1:]]
+        # most rules are plain check names, which can be looked up without a regex
+        if re.escape(line[0]) == line[0]:
+            rules.literal[line[0]] = (idx, depths)
+        else:
+            rules.regex.append((idx, re.compile(line[0]), depths))
+    return rules
+
+
+def parse_assume_patterns(pats: List[str]) -> List[Tuple[re.Pattern, bool]]:
+    # patterns prefixed with '!' are negated
+    return [(re.compile(p[1:]), True) if p.startswith("!") else (re.compile(p), False) for p in pats]
+
+
+def parse_filter_rules(lines: List[Tuple[str, ...]]) -> List[Tuple[str, re.Pattern]]:
+    rules = []
+    for line in lines:
+        assert isinstance(line, tuple)
+        if len(line) == 0:
+            continue
+        assert len(line) == 2 and line[0] in ["-", "+"]
+        rules.append((line[0], re.compile(line[1])))
+    return rules
+
+
 def extract_options(config: Config) -> Tuple[ISAConfig, SolverConfig]:
 
     isa_cfg    = ISAConfig()
@@ -129,8 +217,7 @@ def extract_options(config: Config) -> Tuple[ISAConfig, SolverConfig]:
 
     if "options" in config:
         for line in config["options"]:
-            assert isinstance(line, str)
-            line = line.split()
+            assert isinstance(line, tuple)
 
             if len(line) == 0:
                 continue
@@ -190,30 +277,34 @@ def extract_options(config: Config) -> Tuple[ISAConfig, SolverConfig]:
 
 
 def get_depth_cfg(config: Config, patterns: List[str]) -> Optional[List[int]]:
-    ret = None
-    if "depth" in config:
-        for line in config["depth"]:
-            assert isinstance(line, str)
-            line = line.strip().split()
-            if len(line) == 0:
-                continue
-            for pat in patterns:
-                if re.fullmatch(line[0], pat):
-                    ret = [int(s) for s in line[1:]]
-    return ret
+    if "depth" not in config:
+        return None
+    # the last rule matching any of the patterns wins
+    return max((config["depth"].lookup(pat) for pat in patterns), key=lambda rule: rule[0])[1]
 
 def test_disabled(config: Config, check: str) -> bool:
     if "filter-checks" in config:
-        for line in config["filter-checks"]:
-            assert(isinstance(line, str))
-            line = line.strip().split()
-            if len(line) == 0: continue
-            assert len(line) == 2 and line[0] in ["-", "+"]
-            if re.match(line[1], check):
-                return line[0] == "-"
+        for sign, cre in config["filter-checks"]:
+            if cre.match(check):
+                return sign == "-"
     return False
 
 
+def assume_stmts(config: Config, check: str) -> List[str]:
+    stmts = []
+    for pats, line in config["assume"]:
+        # the first matching pattern decides, if none match the last pattern does
+        enabled = True
+        for cre, negated in pats:
+            enabled = not negated
+            if cre.match(check):
+                enabled = negated
+                break
+        if enabled:
+            stmts.append(line)
+    return stmts
+
+
 def add_all_csrs(config: Config, isa_cfg: ISAConfig):
     if isa_cfg.csr_spec == "1.12":
         spec_csrs = {
@@ -223,20 +314,8 @@ def add_all_csrs(config: Config, isa_cfg: ISAConfig):
             "mhartid"       : ["const"],
             "mconfigptr"    : ["const"],
             # All reserved bits should be 0
-            "mstatus"       : [
-                mask_bits(
-                    "zero", 
-                    [0, 2, 4, *range(23, 31)] + ([31, *range(38, 63)] if isa_cfg.xlen==64 else []),
-                    isa_cfg.xlen
-                )
-            ],
-            "misa"          : [
-                mask_bits(
-                    "zero", 
-                    [6, 10, 11, 14, 17, 19, 22, 24, 25, *range(26, isa_cfg.xlen-2)], 
-                    isa_cfg.xlen
-                )
-            ],
+            "mstatus"       : [_mstatus_mask(isa_cfg.xlen)],
+            "misa"          : [_misa_mask(isa_cfg.xlen)],
             "mie"           : None,
             "mtvec"         : None,
             "mscratch"      : ["any"],
@@ -254,7 +333,7 @@ def add_all_csrs(config: Config, isa_cfg: ISAConfig):
             "medeleg"       : ("s",  "302", None),
             "mideleg"       : ("s",  "303", None),
             "mcounteren"    : ("u",  "306", None),
-            "mstatush"      : ("32", "310", [mask_bits("zero", [4, 5], isa_cfg.xlen, invert=True)]),
+            "mstatush"      : ("32", "310", [_mstatush_mask(isa_cfg.xlen)]),
             "mtinst"        : ("h",  "34A", None),
             "mtval2"        : ("h",  "34B", None),
             "menvcfg"       : ("u",  "30A", None),
@@ -291,8 +370,7 @@ def add_all_csrs(config: Config, isa_cfg: ISAConfig):
 
     if "illegal_csrs" in config:
         for line in config["illegal_csrs"]:
-            assert isinstance(line, str)
-            line = tuple(line.split())
+            assert isinstance(line, tuple)
 
             if len(line) == 0:
                 continue
@@ -301,7 +379,10 @@ def add_all_csrs(config: Config, isa_cfg: ISAConfig):
             isa_cfg.illegal_csrs.add(line)
 
 
-def print_custom_csrs(isa_cfg: ISAConfig, sby_file):
+@lru_cache(maxsize=1)
+def fmt_custom_csrs(custom_csrs: FrozenSet[Tuple[str, int, str]]) -> str:
+    # the macros only depend on the custom csrs, so every check shares one rendering
+    lines = []
     fstrings = {
         "inputs": "  ,input [`RISCV_FORMAL_NRET * `RISCV_FORMAL_XLEN - 1 : 0] rvfi_csr_{csr}_{signal} \\",
         "wires": "  (* keep *) wire [`RISCV_FORMAL_NRET * `RISCV_FORMAL_XLEN - 1 : 0] rvfi_csr_{csr}_{signal}; \\",
@@ -313,10 +394,10 @@ def print_custom_csrs(isa_cfg: ISAConfig, sby_file):
     }
     for (macro, fstring) in fstrings.items():
         if macro == "channel":
-            print(f"`define RISCV_FORMAL_CUSTOM_CSR_{macro.upper()}(_idx) \\" , file=sby_file)
+            lines.append(f"`define RISCV_FORMAL_CUSTOM_CSR_{macro.upper()}(_idx) \\")
         else:
-            print(f"`define RISCV_FORMAL_CUSTOM_CSR_{macro.upper()} \\", file=sby_file)
-        for custom_csr in isa_cfg.custom_csrs:
+            lines.append(f"`define RISCV_FORMAL_CUSTOM_CSR_{macro.upper()} \\")
+        for custom_csr in sorted(custom_csrs):
             name = custom_csr[0]
             addr = custom_csr[1]
             levels = custom_csr[2]
@@ -326,12 +407,13 @@ def print_custom_csrs(isa_cfg: ISAConfig, sby_file):
                         macro_string = fstring.format(level=level, name=name, index=addr)
                     else:
                         macro_string = fstring.format(level=level, name=name, index=0xfff)
-                    print(macro_string, file=sby_file)
+                    lines.append(macro_string)
             else:
                 for signal in ["rmask", "wmask", "rdata", "wdata"]:
                     macro_string = fstring.format(csr=name, signal=signal)
-                    print(macro_string, file=sby_file)
-        print("", file=sby_file)
+                    lines.append(macro_string)
+        lines.append("")
+    return '\n'.join(lines)
 
 
 
@@ -346,8 +428,13 @@ def init_hargs(config: Config, isa_cfg: ISAConfig, solver_cfg: SolverConfig, pat
         "nbus"    : isa_cfg.nbus,
         "append"  : 0,
         "mode"    : solver_cfg.mode,
+        # per check values, insn, check and channel are only set by the checks that have them
+        "start"   : 1,
+        "xmode"   : solver_cfg.mode,
     }
 
+    hargs["common_defines"] = fmt_common_defines(config, isa_cfg, solver_cfg)
+
     if "cover" in config:
         hargs["cover"] = '\n'.join(config["cover"])
 
@@ -363,70 +450,259 @@ def init_hargs(config: Config, isa_cfg: ISAConfig, solver_cfg: SolverConfig, pat
 
     return hargs
 
-def hfmt(text: Union[str, List[str]], **kwargs):
+def fmt_common_defines(config: Config, isa_cfg: ISAConfig, solver_cfg: SolverConfig) -> str:
+    # defines shared by every check, rendered once instead of once per check
+    lines = []
+    if "assume" in config:
+        lines.append("`define RISCV_FORMAL_ASSUME")
+
+    if solver_cfg.mode == "prove":
+        lines.append("`define RISCV_FORMAL_UNBOUNDED")
+
+    for csr in sorted(isa_cfg.csrs):
+        lines.append(f"`define RISCV_FORMAL_CSR_{csr.upper()}")
+    return '\n'.join(lines)
+
+def strip_colon(line: str) -> Optional[str]:
+    # hfmt template lines are prefixed with ': ', returns None for lines without the prefix
+    line = line.lstrip()
+    if line.startswith(": "):
+        return line[2:]
+    if line.startswith(":"):
+        return line[1:]
+    return None
+
+@lru_cache(maxsize=None)
+def compile_hfmt_lines(text: Union[str, Tuple[str, ...]]) -> Tuple[str, ...]:
+    # translates hfmt template lines into str.format_map templates, cached so that
+    # each template is only parsed once instead of once per check
     lines = []
     if isinstance(text, str):
         text = text.split('\n')
     for line in text:
-        match = re.match(r"^\s*: ?(.*)", line)
-        if match:
-            line = match.group(1)
+        stripped = strip_colon(line)
+        if stripped is not None:
+            line = stripped
         elif line.strip() == "":
             continue
-        lines.append(re.sub(r"@([a-zA-Z0-9_]+)@",
-                lambda match: str(kwargs[match.group(1)]), line))
-    return lines
+        line = line.replace("{", "{{").replace("}", "}}")
+        lines.append(_HFMT_SUB_RE.sub(r"{\1}", line))
+    return tuple(lines)
 
-def print_hfmt(f, text, **kwargs):
-    for line in hfmt(text, **kwargs):
-        print(line, file=f)
+def compile_hfmt(text: str) -> str:
+    return '\n'.join(compile_hfmt_lines(text))
+
+def hfmt(text: Union[str, List[str]], **kwargs):
+    if isinstance(text, list):
+        text = tuple(text)
+    try:
+        return [line.format_map(kwargs) for line in compile_hfmt_lines(text)]
+    except KeyError as err:
+        # e.g. @channel@ used by a check that does not run on a single channel
+        raise ValueError(f"@{err.args[0]}@ is not defined for check {kwargs.get('checkch')}") from None
+
+_TMPL_PREP = compile_hfmt("""
+    : prep -flatten -nordff -top rvfi_testbench
+""")
+
+def write_sby(path_cfg: PathConfig, check: str, contents: str):
+    # the whole file is rendered up front, so it goes out in a single write
+    sby_path = f"{path_cfg.cfgname}/{check}.sby"
+    if path_cfg.incremental:
+        # the sby output of the last run is always dropped so make reruns every check,
+        # the sby file does not change with the rtl or the checkers it was run against
+        shutil.rmtree(f"{path_cfg.cfgname}/{check}", ignore_errors=True)
+        # an unchanged sby file is not rewritten
+        try:
+            with open(sby_path) as sby_file:
+                if sby_file.read() == contents:
+                    return
+        except FileNotFoundError:
+            pass
+    with open(sby_path, "w") as sby_file:
+        sby_file.write(contents)
+
+def remove_stale_checks(path_cfg: PathConfig, checks: Set[str]):
+    # drops the checks left over from a previous run that are no longer generated
+    with os.scandir(path_cfg.cfgname) as entries:
+        for entry in entries:
+            check, ext = os.path.splitext(entry.name)
+            if ext == ".sby" and check not in checks:
+                os.remove(entry.path)
+                shutil.rmtree(f"{path_cfg.cfgname}/{check}", ignore_errors=True)
+
+def _run_check(task: partial) -> Optional[Tuple[str, str]]:
+    return task()
+
+def run_checks(tasks: List[partial], path_cfg: PathConfig, jobs: int) -> Set[str]:
+    # every check renders from its own copy of hargs and only writes to the config through
+    # the depth lookup cache, which just memoizes lookups and is private to each worker
+    # process, so the checks can be built by a pool of worker processes in any order
+    # while all of the files are written here by the parent
+    if jobs != 1:
+        with Pool(jobs or None) as pool:
+            return write_checks(pool.imap_unordered(_run_check, tasks, chunksize=128), path_cfg)
+    return write_checks(map(_run_check, tasks), path_cfg)
+
+def write_checks(results: Iterable[Optional[Tuple[str, str]]], path_cfg: PathConfig) -> Set[str]:
+    checks = set()
+    for result in results:
+        # checks skipped by the depth config or filters are returned as None
+        if result is None:
+            continue
+        check, contents = result
+        write_sby(path_cfg, check, contents)
+        checks.add(check)
+    return checks
 
 # ------------------------------ Instruction Checkers ------------------------------
 
+_TMPL_INSN_OPTIONS = compile_hfmt("""
+    : [options]
+    : mode @mode@
+    : expect pass,fail
+    : append @append@
+    : depth @depth_plus@
+    : skip @skip@
+    :
+    : [engines]
+    : @engine@
+    :
+    : [script]
+""")
+
+_TMPL_INSN_FILES = compile_hfmt("""
+    : chformal -early
+    :
+    : [files]
+    : @basedir@/checks/rvfi_macros.vh
+    : @basedir@/checks/rvfi_channel.sv
+    : @basedir@/checks/rvfi_testbench.sv
+""")
+
+_TMPL_CSR_ILL_FILES = compile_hfmt("""
+    : @basedir@/checks/rvfi_csr_ill_check.sv
+""")
+
+_TMPL_CSRW_FILES = compile_hfmt("""
+    : @basedir@/checks/rvfi_csrw_check.sv
+""")
+
+_TMPL_INSN_MODEL_FILES = compile_hfmt("""
+    : @basedir@/checks/rvfi_insn_check.sv
+    : @basedir@/insns/insn_@insn@.v
+""")
+
+_TMPL_INSN_DEFINES = compile_hfmt("""
+    :
+    : [file defines.sv]
+    : `define RISCV_FORMAL
+    : `define RISCV_FORMAL_NRET @nret@
+    : `define RISCV_FORMAL_XLEN @xlen@
+    : `define RISCV_FORMAL_ILEN @ilen@
+    : `define RISCV_FORMAL_RESET_CYCLES 1
+    : `define RISCV_FORMAL_CHECK_CYCLE @depth@
+    : `define RISCV_FORMAL_CHANNEL_IDX @channel@
+""")
+
+_TMPL_CSR_ILL_CHECKER = compile_hfmt("""
+    : `define RISCV_FORMAL_CHECKER rvfi_csr_ill_check
+    : `define RISCV_FORMAL_ILL_CSR_ADDR @insn@
+""")
+
+_TMPL_CSRW_CHECKER = compile_hfmt("""
+    : `define RISCV_FORMAL_CHECKER rvfi_csrw_check
+    : `define RISCV_FORMAL_CSRW_NAME @insn@
+""")
+
+_TMPL_INSN_MODEL_CHECKER = compile_hfmt("""
+    : `define RISCV_FORMAL_CHECKER rvfi_insn_check
+    : `define RISCV_FORMAL_INSN_MODEL rvfi_insn_@insn@
+""")
+
+_TMPL_INSN_INCLUDES = compile_hfmt("""
+    : `include "rvfi_macros.vh"
+    :
+    : [file @checkch@.sv]
+    : `include "defines.sv"
+    : `include "rvfi_channel.sv"
+    : `include "rvfi_testbench.sv"
+""")
+
+_TMPL_CSR_ILL_INCLUDES = compile_hfmt("""
+    : `include "rvfi_csr_ill_check.sv"
+""")
+
+_TMPL_CSRW_INCLUDES = compile_hfmt("""
+    : `include "rvfi_csrw_check.sv"
+""")
+
+_TMPL_INSN_MODEL_INCLUDES = compile_hfmt("""
+    : `include "rvfi_insn_check.sv"
+    : `include "insn_@insn@.v"
+""")
+
+
 def add_all_check_insn(
     config: Config, 
     hargs: Dict[str, Any],
     isa_cfg: ISAConfig, 
     solver_cfg: SolverConfig,
     path_cfg: PathConfig,
+    jobs: int = 1,
 ) -> Set[str]:
 
-    checks = []
+    tasks = []
 
     isa_file_path = f"{path_cfg.basedir}/insns/isa_{isa_cfg.isa}.txt"
+    with open(isa_file_path) as isa_file:
+        insns = tuple(insn.strip() for insn in isa_file if insn.strip())
+
+    csrs = sorted(isa_cfg.csrs)
+    illegal_csrs = pack_illegal_csrs(isa_cfg.illegal_csrs)
 
     for grp in solver_cfg.groups:
-        with open(isa_file_path) as isa_file:
-            for insn in isa_file:
-                for chanidx in range(isa_cfg.nret):
-                    checks.append(check_insn(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, insn.strip(), chanidx))
+        for insn in insns:
+            for chanidx in range(isa_cfg.nret):
+                tasks.append(partial(check_insn, config, hargs, isa_cfg, solver_cfg, grp, insn, chanidx))
 
-        for csr in sorted(isa_cfg.csrs):
+        for csr in csrs:
             for chanidx in range(isa_cfg.nret):
-                checks.append(check_insn(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, csr, chanidx, csr_mode=True))
+                tasks.append(partial(check_insn, config, hargs, isa_cfg, solver_cfg, grp, csr, chanidx, csr_mode=True))
 
-        for ill_csr in sorted(isa_cfg.illegal_csrs, key=lambda csr: csr[0]):
+        for ill_csr in illegal_csrs:
             for chanidx in range(isa_cfg.nret):
-                checks.append(check_insn(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, ill_csr, chanidx, illegal_csr=True))
+                tasks.append(partial(check_insn, config, hargs, isa_cfg, solver_cfg, grp, ill_csr, chanidx, illegal_csr=True))
+
+    return run_checks(tasks, path_cfg, jobs)
 
-    return set(filter(lambda check: check is not None, checks))
+# mode and access flags of packed illegal csrs
+ILL_MMODE, ILL_SMODE, ILL_UMODE = 1, 2, 4
+ILL_READ, ILL_WRITE = 1, 2
+
+def pack_illegal_csrs(illegal_csrs: Set[Tuple[str, str, str]]) -> List[Tuple[str, int, int, int]]:
+    # parse the (addr, modes, rw) strings of each illegal csr once, instead of once per check
+    packed = []
+    for (addr, modes, rw) in illegal_csrs:
+        mode_flags = (ILL_MMODE if 'm' in modes else 0) | (ILL_SMODE if 's' in modes else 0) | (ILL_UMODE if 'u' in modes else 0)
+        rw_flags   = (ILL_READ if 'r' in rw else 0) | (ILL_WRITE if 'w' in rw else 0)
+        packed.append((addr, int(addr, base=16), mode_flags, rw_flags))
+    return sorted(packed, key=lambda csr: (csr[1], csr[0]))
 
 def check_insn(
     config: Config,
     hargs: Dict[str, Any],
     isa_cfg: ISAConfig,
     solver_cfg: SolverConfig,
-    path_cfg: PathConfig,
     grp: str,
     insn: str,
     chanidx: int,
     csr_mode=False,
     illegal_csr=False
-) -> Optional[str]:
+) -> Optional[Tuple[str, str]]:
     pf = "" if grp is None else grp+"_"
     if illegal_csr:
-        (ill_addr, ill_modes, ill_rw) = insn
-        insn = f"12'h{int(ill_addr, base=16):03X}"
+        (ill_addr, ill_addr_val, ill_modes, ill_rw) = insn
         check = f"{pf}csr_ill_{ill_addr}_ch{chanidx:d}"
         depth_cfg = get_depth_cfg(config, [f"{pf}csr_ill", f"{pf}csr_ill_ch{chanidx:d}", f"{pf}csr_ill_{ill_addr}", f"{pf}csr_ill_{ill_addr}_ch{chanidx:d}"])
     else:
@@ -437,12 +713,18 @@ def check_insn(
         depth_cfg = get_depth_cfg(config, [f"{pf}{check}", f"{pf}{check}_ch{chanidx:d}", f"{pf}{check}_{insn}", f"{pf}{check}_{insn}_ch{chanidx:d}"])
         check = f"{pf}{check}_{insn}_ch{chanidx:d}"
 
+    # skip before doing any work for checks without a depth config or that are filtered out
     if depth_cfg is None: return
     assert len(depth_cfg) == 1
 
     if test_disabled(config, check):
         return None
 
+    if illegal_csr:
+        insn = f"12'h{ill_addr_val:03X}"
+
+    # each check renders from its own copy, so it never sees the values of another check
+    hargs = dict(hargs)
     hargs["insn"] = insn
     hargs["checkch"] = check
     hargs["channel"] = f"{chanidx:d}"
@@ -450,220 +732,215 @@ def check_insn(
     hargs["depth_plus"] = depth_cfg[0] + 1
     hargs["skip"] = depth_cfg[0]
 
-    with open(f"{path_cfg.cfgname}/{check}.sby", "w") as sby_file:
-        print_hfmt(sby_file, """
-                : [options]
-                : mode @mode@
-                : expect pass,fail
-                : append @append@
-                : depth @depth_plus@
-                : skip @skip@
-                :
-                : [engines]
-                : @engine@
-                :
-                : [script]
-        """, **hargs)
-
-        if "script-defines" in config:
-            print_hfmt(sby_file, config["script-defines"], **hargs)
-
-        sv_files = [f"{check}.sv"]
-        if "verilog-files" in config:
-            sv_files += hfmt(config["verilog-files"], **hargs)
-
-        vhdl_files = []
-        if "vhdl-files" in config:
-            vhdl_files += hfmt(config["vhdl-files"], **hargs)
-
-        if len(sv_files):
-            print(f"read -sv {' '.join(sv_files)}", file=sby_file)
-
-        if len(vhdl_files):
-            print(f"read -vhdl {' '.join(vhdl_files)}", file=sby_file)
-
-        if "script-sources" in config:
-            print_hfmt(sby_file, config["script-sources"], **hargs)
-
-        print_hfmt(sby_file, """
-                : prep -flatten -nordff -top rvfi_testbench
-        """, **hargs)
-
-        if "script-link" in config:
-            print_hfmt(sby_file, config["script-link"], **hargs)
-
-        print_hfmt(sby_file, """
-                : chformal -early
-                :
-                : [files]
-                : @basedir@/checks/rvfi_macros.vh
-                : @basedir@/checks/rvfi_channel.sv
-                : @basedir@/checks/rvfi_testbench.sv
-        """, **hargs)
-
-        if illegal_csr:
-            print_hfmt(sby_file, """
-                    : @basedir@/checks/rvfi_csr_ill_check.sv
-            """, **hargs)
-        elif csr_mode:
-            print_hfmt(sby_file, """
-                    : @basedir@/checks/rvfi_csrw_check.sv
-            """, **hargs)
-        else:
-            print_hfmt(sby_file, """
-                    : @basedir@/checks/rvfi_insn_check.sv
-                    : @basedir@/insns/insn_@insn@.v
-            """, **hargs)
-
-        print_hfmt(sby_file, """
-                :
-                : [file defines.sv]
-                : `define RISCV_FORMAL
-                : `define RISCV_FORMAL_NRET @nret@
-                : `define RISCV_FORMAL_XLEN @xlen@
-                : `define RISCV_FORMAL_ILEN @ilen@
-                : `define RISCV_FORMAL_RESET_CYCLES 1
-                : `define RISCV_FORMAL_CHECK_CYCLE @depth@
-                : `define RISCV_FORMAL_CHANNEL_IDX @channel@
-        """, **hargs)
-
-        if "assume" in config:
-            print("`define RISCV_FORMAL_ASSUME", file=sby_file)
-
-        if solver_cfg.mode == "prove":
-            print("`define RISCV_FORMAL_UNBOUNDED", file=sby_file)
-
-        for csr in sorted(isa_cfg.csrs):
-            print(f"`define RISCV_FORMAL_CSR_{csr.upper()}", file=sby_file)
-
-        if csr_mode and insn in ("mcycle", "minstret"):
-            print("`define RISCV_FORMAL_CSRWH", file=sby_file)
-
-        if illegal_csr:
-            print_hfmt(sby_file, """
-                    : `define RISCV_FORMAL_CHECKER rvfi_csr_ill_check
-                    : `define RISCV_FORMAL_ILL_CSR_ADDR @insn@
-            """, **hargs)
-            if 'm' in ill_modes:
-                print("`define RISCV_FORMAL_ILL_MMODE", file=sby_file)
-            if 's' in ill_modes:
-                print("`define RISCV_FORMAL_ILL_SMODE", file=sby_file)
-            if 'u' in ill_modes:
-                print("`define RISCV_FORMAL_ILL_UMODE", file=sby_file)
-            if 'r' in ill_rw:
-                print("`define RISCV_FORMAL_ILL_READ", file=sby_file)
-            if 'w' in ill_rw:
-                print("`define RISCV_FORMAL_ILL_WRITE", file=sby_file)
-        elif csr_mode:
-            print_hfmt(sby_file, """
-                    : `define RISCV_FORMAL_CHECKER rvfi_csrw_check
-                    : `define RISCV_FORMAL_CSRW_NAME @insn@
-            """, **hargs)
-        else:
-            print_hfmt(sby_file, """
-                    : `define RISCV_FORMAL_CHECKER rvfi_insn_check
-                    : `define RISCV_FORMAL_INSN_MODEL rvfi_insn_@insn@
-            """, **hargs)
-
-        if isa_cfg.custom_csrs:
-            print_custom_csrs(isa_cfg, sby_file)
-
-        if solver_cfg.blackbox:
-            print("`define RISCV_FORMAL_BLACKBOX_REGS", file=sby_file)
-
-        if isa_cfg.compr:
-            print("`define RISCV_FORMAL_COMPRESSED", file=sby_file)
-
-        if "defines" in config:
-            print_hfmt(sby_file, config["defines"], **hargs)
-
-        print_hfmt(sby_file, """
-                : `include "rvfi_macros.vh"
-                :
-                : [file @checkch@.sv]
-                : `include "defines.sv"
-                : `include "rvfi_channel.sv"
-                : `include "rvfi_testbench.sv"
-        """, **hargs)
-
-        if illegal_csr:
-            print_hfmt(sby_file, """
-                    : `include "rvfi_csr_ill_check.sv"
-            """, **hargs)
-        elif csr_mode:
-            print_hfmt(sby_file, """
-                    : `include "rvfi_csrw_check.sv"
-            """, **hargs)
-        else:
-            print_hfmt(sby_file, """
-                    : `include "rvfi_insn_check.sv"
-                    : `include "insn_@insn@.v"
-            """, **hargs)
-
-        if "assume" in config:
-            print("", file=sby_file)
-            print("[file assume_stmts.vh]", file=sby_file)
-            for pat, line in config["assume"]:
-                enabled = True
-                for p in pat:
-                    if p.startswith("!"):
-                        p = p[1:]
-                        enabled = False
-                    else:
-                        enabled = True
-                    if re.match(p, check):
-                        enabled = not enabled
-                        break
-                if enabled:
-                    print(line, file=sby_file)
+    parts: List[str] = []
+    emit = parts.append
+
+    emit(_TMPL_INSN_OPTIONS.format_map(hargs))
+
+    if "script-defines" in config:
+        parts.extend(hfmt(config["script-defines"], **hargs))
+
+    sv_files = [f"{check}.sv"]
+    if "verilog-files" in config:
+        sv_files += hfmt(config["verilog-files"], **hargs)
+
+    vhdl_files = []
+    if "vhdl-files" in config:
+        vhdl_files += hfmt(config["vhdl-files"], **hargs)
+
+    if len(sv_files):
+        emit(f"read -sv {' '.join(sv_files)}")
+
+    if len(vhdl_files):
+        emit(f"read -vhdl {' '.join(vhdl_files)}")
+
+    if "script-sources" in config:
+        parts.extend(hfmt(config["script-sources"], **hargs))
+
+    emit(_TMPL_PREP.format_map(hargs))
+
+    if "script-link" in config:
+        parts.extend(hfmt(config["script-link"], **hargs))
+
+    emit(_TMPL_INSN_FILES.format_map(hargs))
+
+    if illegal_csr:
+        emit(_TMPL_CSR_ILL_FILES.format_map(hargs))
+    elif csr_mode:
+        emit(_TMPL_CSRW_FILES.format_map(hargs))
+    else:
+        emit(_TMPL_INSN_MODEL_FILES.format_map(hargs))
+
+    emit(_TMPL_INSN_DEFINES.format_map(hargs))
 
-        return check
+    if hargs["common_defines"]:
+        emit(hargs["common_defines"])
+
+    if csr_mode and insn in ("mcycle", "minstret"):
+        emit("`define RISCV_FORMAL_CSRWH")
+
+    if illegal_csr:
+        emit(_TMPL_CSR_ILL_CHECKER.format_map(hargs))
+        if ill_modes & ILL_MMODE:
+            emit("`define RISCV_FORMAL_ILL_MMODE")
+        if ill_modes & ILL_SMODE:
+            emit("`define RISCV_FORMAL_ILL_SMODE")
+        if ill_modes & ILL_UMODE:
+            emit("`define RISCV_FORMAL_ILL_UMODE")
+        if ill_rw & ILL_READ:
+            emit("`define RISCV_FORMAL_ILL_READ")
+        if ill_rw & ILL_WRITE:
+            emit("`define RISCV_FORMAL_ILL_WRITE")
+    elif csr_mode:
+        emit(_TMPL_CSRW_CHECKER.format_map(hargs))
+    else:
+        emit(_TMPL_INSN_MODEL_CHECKER.format_map(hargs))
+
+    if isa_cfg.custom_csrs:
+        emit(fmt_custom_csrs(frozenset(isa_cfg.custom_csrs)))
+
+    if solver_cfg.blackbox:
+        emit("`define RISCV_FORMAL_BLACKBOX_REGS")
+
+    if isa_cfg.compr:
+        emit("`define RISCV_FORMAL_COMPRESSED")
+
+    if "defines" in config:
+        parts.extend(hfmt(config["defines"], **hargs))
+
+    emit(_TMPL_INSN_INCLUDES.format_map(hargs))
+
+    if illegal_csr:
+        emit(_TMPL_CSR_ILL_INCLUDES.format_map(hargs))
+    elif csr_mode:
+        emit(_TMPL_CSRW_INCLUDES.format_map(hargs))
+    else:
+        emit(_TMPL_INSN_MODEL_INCLUDES.format_map(hargs))
+
+    if "assume" in config:
+        emit("")
+        emit("[file assume_stmts.vh]")
+        parts.extend(assume_stmts(config, check))
+
+    return check, '\n'.join(parts) + '\n'
 
 
 
 # ------------------------------ Consistency Checkers ------------------------------
 
+_TMPL_CONS_OPTIONS = compile_hfmt("""
+    : [options]
+    : mode @xmode@
+    : expect pass,fail
+    : append @append@
+    : depth @depth_plus@
+    : skip @skip@
+    :
+    : [engines]
+    : @engine@
+    :
+    : [script]
+""")
+
+_TMPL_CONS_FILES = compile_hfmt("""
+    : chformal -early
+    :
+    : [files]
+    : @basedir@/checks/rvfi_macros.vh
+    : @basedir@/checks/rvfi_channel.sv
+    : @basedir@/checks/rvfi_testbench.sv
+    : @basedir@/checks/rvfi_@check@_check.sv
+    :
+    : [file defines.sv]
+""")
+
+_TMPL_CONS_DEFINES = compile_hfmt("""
+    : `define RISCV_FORMAL
+    : `define RISCV_FORMAL_NRET @nret@
+    : `define RISCV_FORMAL_XLEN @xlen@
+    : `define RISCV_FORMAL_ILEN @ilen@
+    : `define RISCV_FORMAL_CHECKER rvfi_@check@_check
+    : `define RISCV_FORMAL_RESET_CYCLES @start@
+    : `define RISCV_FORMAL_CHECK_CYCLE @depth@
+""")
+
+_TMPL_BUS_DEFINES = compile_hfmt("""
+    : `define RISCV_FORMAL_BUS
+    : `define RISCV_FORMAL_NBUS @nbus@
+    : `define RISCV_FORMAL_BUSLEN @buslen@
+""")
+
+_TMPL_CONS_INCLUDES = compile_hfmt("""
+    : `include "rvfi_macros.vh"
+    :
+    : [file @checkch@.sv]
+    : `include "defines.sv"
+    : `include "rvfi_channel.sv"
+    : `include "rvfi_testbench.sv"
+    : `include "rvfi_@check@_check.sv"
+""")
+
+_TMPL_COVER = compile_hfmt("""
+    :
+    : [file cover_stmts.vh]
+    : @cover@
+""")
+
+
 def add_all_consistency_checks(
     config: Config, 
     hargs: Dict[str, Any],
     isa_cfg: ISAConfig, 
     solver_cfg: SolverConfig,
     path_cfg: PathConfig,
+    jobs: int = 1,
 ) -> Set[str]:
-    checks = []
+    tasks = []
+
+    csrs = sorted(isa_cfg.csrs)
 
     for grp in solver_cfg.groups:
         for i in range(isa_cfg.nret):
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "reg", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "pc_fwd", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "pc_bwd", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "liveness", chanidx=i, start=0, trig=1, depth=2))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "unique", chanidx=i, start=0, trig=1, depth=2))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "causal", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "causal_mem", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "causal_io", chanidx=i, start=0, depth=1))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "ill", chanidx=i, depth=0))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "fault", chanidx=i, depth=0))
-
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_imem", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_imem_fault", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_fault", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_io_read", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_io_read_fault", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_io_write", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_io_write_fault", chanidx=i, start=0, depth=1, bus_mode=True))
-            checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "bus_dmem_io_order", chanidx=i, start=0, depth=1, bus_mode=True))
-
-        checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "hang", start=0, depth=1))
-        checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, "cover", start=0, depth=1))
-
-        for csr in sorted(isa_cfg.csrs):
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "reg", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "pc_fwd", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "pc_bwd", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "liveness", chanidx=i, start=0, trig=1, depth=2))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "unique", chanidx=i, start=0, trig=1, depth=2))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "causal", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "causal_mem", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "causal_io", chanidx=i, start=0, depth=1))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "ill", chanidx=i, depth=0))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "fault", chanidx=i, depth=0))
+
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_imem", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_imem_fault", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_fault", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_io_read", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_io_read_fault", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_io_write", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_io_write_fault", chanidx=i, start=0, depth=1, bus_mode=True))
+            tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "bus_dmem_io_order", chanidx=i, start=0, depth=1, bus_mode=True))
+
+        tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "hang", start=0, depth=1))
+        tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, "cover", start=0, depth=1))
+
+        for csr in csrs:
             for chanidx in range(isa_cfg.nret):
                 for csr_test in isa_cfg.csr_tests.get(csr, [None]):
-                    checks.append(check_cons(config, hargs, isa_cfg, solver_cfg, path_cfg, grp, csr, chanidx, start=0, depth=1, csr_mode=True, csr_test=csr_test))
+                    # hpm checks also need the matching counter, which changes the defines of every later check
+                    if csr_test is not None and csr_test.startswith("hpm"):
+                        hpmcounter = csr.replace("event", "counter")
+                        if hpmcounter not in isa_cfg.csrs:
+                            isa_cfg.csrs.add(hpmcounter)
+                            hargs = dict(hargs, common_defines=fmt_common_defines(config, isa_cfg, solver_cfg))
+                    tasks.append(partial(check_cons, config, hargs, isa_cfg, solver_cfg, grp, csr, chanidx, start=0, depth=1, csr_mode=True, csr_test=csr_test))
 
-    return set(filter(lambda check: check is not None, checks))
+        # hpm checks may have registered new counters, which the following groups check as well
+        if len(csrs) != len(isa_cfg.csrs):
+            csrs = sorted(isa_cfg.csrs)
+
+    return run_checks(tasks, path_cfg, jobs)
 
 
 def check_cons(
@@ -671,7 +948,6 @@ def check_cons(
     hargs: Dict[str, Any],
     isa_cfg: ISAConfig,
     solver_cfg: SolverConfig,
-    path_cfg: PathConfig,
     grp: str,
     check: str,
     chanidx=None,
@@ -681,36 +957,36 @@ def check_cons(
     csr_mode=False,
     csr_test=None,
     bus_mode=False
-) -> Optional[str]:
+) -> Optional[Tuple[str, str]]:
 
     pf = "" if grp is None else grp+"_"
     if csr_mode:
         csr_name = check
+        # values of the optional RISCV_FORMAL_CSRC_* defines, see csr_defs below
+        csr_vals: Dict[str, str] = {}
         if csr_test is not None:
             # Check for provided mask
             mask_idx = csr_test.find("_mask")
             if mask_idx >= 0:
                 try:
-                    csr_mask = str(csr_test[mask_idx:]).split('=', maxsplit=1)[1].strip('"')
+                    csr_vals["csr_mask"] = str(csr_test[mask_idx:]).split('=', maxsplit=1)[1].strip('"')
                 except IndexError: # no value provided
                     print(csr_test)
                     assert 0
                 csr_test = csr_test[:mask_idx]
             if csr_test.startswith("const"):
                 try:
-                    constval = str(csr_test).split('=', maxsplit=1)[1].strip('"')
+                    csr_vals["constval"] = str(csr_test).split('=', maxsplit=1)[1].strip('"')
                 except IndexError: # no value provided
-                    constval = "rdata_shadow"
+                    csr_vals["constval"] = "rdata_shadow"
                 check = f"{pf}csrc_const_{csr_name}"
                 check_name = f"csrc_const"
             elif csr_test.startswith("hpm"):
                 try:
-                    hpmevent = str(csr_test).split('=', maxsplit=1)[1].strip('"')
+                    csr_vals["hpmevent"] = str(csr_test).split('=', maxsplit=1)[1].strip('"')
                 except IndexError: # no value provided
                     pass
-                hpmcounter = str(csr_name).replace("event", "counter")
-                if hpmcounter not in isa_cfg.csrs:
-                    isa_cfg.csrs.add(hpmcounter)
+                csr_vals["hpmcounter"] = str(csr_name).replace("event", "counter")
                 check = f"{pf}csrc_hpm_{csr_name}"
                 check_name = f"csrc_hpm"
             else:
@@ -721,29 +997,35 @@ def check_cons(
             check = f"{pf}csrc_{csr_name}"
             check_name = "csrc"
 
-        hargs["check"] = check_name
-
         if chanidx is not None:
             depth_cfg = get_depth_cfg(config, [f"{pf}{check_name}", check, f"{pf}{check_name}_ch{chanidx:d}", f"{check}_ch{chanidx:d}"])
-            hargs["channel"] = f"{chanidx:d}"
             check = f"{check}_ch{chanidx:d}"
 
         else:
             depth_cfg = get_depth_cfg(config, [f"{check_name}", check])
     else:
-        hargs["check"] = check
+        check_name = check
         check = pf + check
 
         if chanidx is not None:
             depth_cfg = get_depth_cfg(config, [check, f"{check}_ch{chanidx:d}"])
-            hargs["channel"] = f"{chanidx:d}"
             check = f"{check}_ch{chanidx:d}"
 
         else:
             depth_cfg = get_depth_cfg(config, [check])
 
+    # skip before doing any work for checks without a depth config or that are filtered out
     if depth_cfg is None: return
 
+    if test_disabled(config, check):
+        return None
+
+    # each check renders from its own copy, so it never sees the values of another check
+    hargs = dict(hargs)
+    hargs["check"] = check_name
+    if chanidx is not None:
+        hargs["channel"] = f"{chanidx:d}"
+
     if start is not None:
         start = depth_cfg[start]
     else:
@@ -765,202 +1047,145 @@ def check_cons(
     hargs["xmode"] = hargs["mode"]
     if check == "cover" or "csrc_hpm" in check: hargs["xmode"] = "cover"
 
-    if test_disabled(config, check): 
-        return None
+    parts: List[str] = []
+    emit = parts.append
 
-    with open(f"{path_cfg.cfgname}/{check}.sby", "w") as sby_file:
-        print_hfmt(sby_file, """
-                : [options]
-                : mode @xmode@
-                : expect pass,fail
-                : append @append@
-                : depth @depth_plus@
-                : skip @skip@
-                :
-                : [engines]
-                : @engine@
-                :
-                : [script]
-        """, **hargs)
-
-        if "script-defines" in config:
-            print_hfmt(sby_file, config["script-defines"], **hargs)
-
-        if (f"script-defines {hargs['check']}") in config:
-            print_hfmt(sby_file, config[f"script-defines {hargs['check']}"], **hargs)
-
-        sv_files = [f"{check}.sv"]
-        if "verilog-files" in config:
-            sv_files += hfmt(config["verilog-files"], **hargs)
-
-        vhdl_files = []
-        if "vhdl-files" in config:
-            vhdl_files += hfmt(config["vhdl-files"], **hargs)
-
-        if len(sv_files):
-            print(f"read -sv {' '.join(sv_files)}", file=sby_file)
-
-        if len(vhdl_files):
-            print(f"read -vhdl {' '.join(vhdl_files)}", file=sby_file)
-
-        if "script-sources" in config:
-            print_hfmt(sby_file, config["script-sources"], **hargs)
-
-        print_hfmt(sby_file, """
-                : prep -flatten -nordff -top rvfi_testbench
-        """, **hargs)
-
-        if "script-link" in config:
-            print_hfmt(sby_file, config["script-link"], **hargs)
-
-        print_hfmt(sby_file, """
-                : chformal -early
-                :
-                : [files]
-                : @basedir@/checks/rvfi_macros.vh
-                : @basedir@/checks/rvfi_channel.sv
-                : @basedir@/checks/rvfi_testbench.sv
-                : @basedir@/checks/rvfi_@check@_check.sv
-                :
-                : [file defines.sv]
-        """, **hargs)
-
-        print_hfmt(sby_file, """
-                : `define RISCV_FORMAL
-                : `define RISCV_FORMAL_NRET @nret@
-                : `define RISCV_FORMAL_XLEN @xlen@
-                : `define RISCV_FORMAL_ILEN @ilen@
-                : `define RISCV_FORMAL_CHECKER rvfi_@check@_check
-                : `define RISCV_FORMAL_RESET_CYCLES @start@
-                : `define RISCV_FORMAL_CHECK_CYCLE @depth@
-        """, **hargs)
-
-        if "assume" in config:
-            print("`define RISCV_FORMAL_ASSUME", file=sby_file)
-
-        if solver_cfg.mode == "prove":
-            print("`define RISCV_FORMAL_UNBOUNDED", file=sby_file)
-
-        for csr in sorted(isa_cfg.csrs):
-            print(f"`define RISCV_FORMAL_CSR_{csr.upper()}", file=sby_file)
+    emit(_TMPL_CONS_OPTIONS.format_map(hargs))
 
-        if csr_mode:
-            localdict = locals()
-            csr_defs = [
-                ("RISCV_FORMAL_CSRC_CONSTVAL", "constval"),
-                ("RISCV_FORMAL_CSRC_HPMEVENT", "hpmevent"),
-                ("RISCV_FORMAL_CSRC_HPMCOUNTER", "hpmcounter"),
-                ("RISCV_FORMAL_CSRC_MASK", "csr_mask"),
-            ]
-            for key, val  in csr_defs:
-                try:
-                    print(f"`define {key} {localdict[val]}", file=sby_file)
-                except KeyError:
-                    # no val for key
-                    pass
-            print(f"`define RISCV_FORMAL_CSRC_NAME {csr_name}", file=sby_file)
+    if "script-defines" in config:
+        parts.extend(hfmt(config["script-defines"], **hargs))
 
-        if isa_cfg.custom_csrs:
-            print_custom_csrs(isa_cfg, sby_file)
+    script_defines_key = f"script-defines {check_name}"
+    if script_defines_key in config:
+        parts.extend(hfmt(config[script_defines_key], **hargs))
 
-        if solver_cfg.blackbox and hargs["check"] != "liveness":
-            print("`define RISCV_FORMAL_BLACKBOX_ALU", file=sby_file)
+    sv_files = [f"{check}.sv"]
+    if "verilog-files" in config:
+        sv_files += hfmt(config["verilog-files"], **hargs)
 
-        if solver_cfg.blackbox and hargs["check"] != "reg":
-            print("`define RISCV_FORMAL_BLACKBOX_REGS", file=sby_file)
+    vhdl_files = []
+    if "vhdl-files" in config:
+        vhdl_files += hfmt(config["vhdl-files"], **hargs)
 
-        if chanidx is not None:
-            print(f"`define RISCV_FORMAL_CHANNEL_IDX {chanidx:d}", file=sby_file)
-
-        if trig is not None:
-            print(f"`define RISCV_FORMAL_TRIG_CYCLE {trig:d}", file=sby_file)
-
-        if bus_mode:
-            print_hfmt(sby_file, """
-                    : `define RISCV_FORMAL_BUS
-                    : `define RISCV_FORMAL_NBUS @nbus@
-                    : `define RISCV_FORMAL_BUSLEN @buslen@
-            """, **hargs)
-
-        if hargs["check"] in ("liveness", "hang"):
-            print("`define RISCV_FORMAL_FAIRNESS", file=sby_file)
-
-        if "defines" in config:
-            print_hfmt(sby_file, config["defines"], **hargs)
-
-        if (f"defines {hargs['check']}") in config:
-            print_hfmt(sby_file, config[f"defines {hargs['check']}"], **hargs)
-
-        print_hfmt(sby_file, """
-                : `include "rvfi_macros.vh"
-                :
-                : [file @checkch@.sv]
-                : `include "defines.sv"
-                : `include "rvfi_channel.sv"
-                : `include "rvfi_testbench.sv"
-                : `include "rvfi_@check@_check.sv"
-        """, **hargs)
-
-        if check == pf+"cover":
-            print_hfmt(sby_file, """
-                    :
-                    : [file cover_stmts.vh]
-                    : @cover@
-            """, **hargs)
-
-        if "assume" in config:
-            print("", file=sby_file)
-            print("[file assume_stmts.vh]", file=sby_file)
-            for pat, line in config["assume"]:
-                enabled = True
-                for p in pat:
-                    if p.startswith("!"):
-                        p = p[1:]
-                        enabled = False
-                    else:
-                        enabled = True
-                    if re.match(p, check):
-                        enabled = not enabled
-                        break
-                if enabled:
-                    print(line, file=sby_file)
+    if len(sv_files):
+        emit(f"read -sv {' '.join(sv_files)}")
+
+    if len(vhdl_files):
+        emit(f"read -vhdl {' '.join(vhdl_files)}")
+
+    if "script-sources" in config:
+        parts.extend(hfmt(config["script-sources"], **hargs))
+
+    emit(_TMPL_PREP.format_map(hargs))
+
+    if "script-link" in config:
+        parts.extend(hfmt(config["script-link"], **hargs))
 
-    return check
+    emit(_TMPL_CONS_FILES.format_map(hargs))
+
+    emit(_TMPL_CONS_DEFINES.format_map(hargs))
+
+    if hargs["common_defines"]:
+        emit(hargs["common_defines"])
+
+    if csr_mode:
+        csr_defs = [
+            ("RISCV_FORMAL_CSRC_CONSTVAL", "constval"),
+            ("RISCV_FORMAL_CSRC_HPMEVENT", "hpmevent"),
+            ("RISCV_FORMAL_CSRC_HPMCOUNTER", "hpmcounter"),
+            ("RISCV_FORMAL_CSRC_MASK", "csr_mask"),
+        ]
+        for key, val in csr_defs:
+            if val in csr_vals:
+                emit(f"`define {key} {csr_vals[val]}")
+        emit(f"`define RISCV_FORMAL_CSRC_NAME {csr_name}")
+
+    if isa_cfg.custom_csrs:
+        emit(fmt_custom_csrs(frozenset(isa_cfg.custom_csrs)))
+
+    if solver_cfg.blackbox and check_name != "liveness":
+        emit("`define RISCV_FORMAL_BLACKBOX_ALU")
+
+    if solver_cfg.blackbox and check_name != "reg":
+        emit("`define RISCV_FORMAL_BLACKBOX_REGS")
+
+    if chanidx is not None:
+        emit(f"`define RISCV_FORMAL_CHANNEL_IDX {chanidx:d}")
+
+    if trig is not None:
+        emit(f"`define RISCV_FORMAL_TRIG_CYCLE {trig:d}")
+
+    if bus_mode:
+        emit(_TMPL_BUS_DEFINES.format_map(hargs))
+
+    if check_name in ("liveness", "hang"):
+        emit("`define RISCV_FORMAL_FAIRNESS")
+
+    if "defines" in config:
+        parts.extend(hfmt(config["defines"], **hargs))
+
+    defines_key = f"defines {check_name}"
+    if defines_key in config:
+        parts.extend(hfmt(config[defines_key], **hargs))
+
+    emit(_TMPL_CONS_INCLUDES.format_map(hargs))
+
+    if check_name == "cover":
+        emit(_TMPL_COVER.format_map(hargs))
+
+    if "assume" in config:
+        emit("")
+        emit("[file assume_stmts.vh]")
+        parts.extend(assume_stmts(config, check))
+
+    return check, '\n'.join(parts) + '\n'
 
 
 # ------------------------------ Makefile ------------------------------
 
 def create_makefile(config: Config, solver_cfg: SolverConfig, path_cfg: PathConfig, cons_checks: Set[str], inst_checks: Set[str]):
-    with open(f"{path_cfg.cfgname}/makefile", "w") as mkfile:
-        print("all:", end="", file=mkfile)
+    # the instruction and consistency checks never share a name, so the two sets can
+    # be concatenated into the sort buffer without building their union
+    checks = [*cons_checks, *inst_checks]
+    checks.sort(key=lambda check: checks_key(config, check))
 
-        checks = list(sorted(cons_checks | inst_checks, key=lambda check: checks_key(config, check)))
+    if solver_cfg.abspath:
+        cmd_prefix = f"\t{solver_cfg.sbycmd} $(shell pwd)/"
+    else:
+        cmd_prefix = f"\t{solver_cfg.sbycmd} "
 
-        for check in checks:
-            print(f" {check}", end="", file=mkfile)
-        print(file=mkfile)
+    parts: List[str] = []
+    emit = parts.append
 
-        for check in checks:
-            print(f"{check}: {check}/status", file=mkfile)
-            print(f"{check}/status:", file=mkfile)
-            if solver_cfg.abspath:
-                print(f"\t{solver_cfg.sbycmd} $(shell pwd)/{check}.sby", file=mkfile)
-            else:
-                print(f"\t{solver_cfg.sbycmd} {check}.sby", file=mkfile)
-            print(f".PHONY: {check}", file=mkfile)
+    emit("all:" + "".join(f" {check}" for check in checks))
+
+    for check in checks:
+        emit(f"{check}: {check}/status")
+        emit(f"{check}/status:")
+        emit(f"{cmd_prefix}{check}.sby")
+        emit(f".PHONY: {check}")
+
+    with open(f"{path_cfg.cfgname}/makefile", "w") as mkfile:
+        mkfile.write('\n'.join(parts) + '\n')
 
 
 def checks_key(config: Config, check: str) -> str:
     if "sort" in config:
-        for index, line in enumerate(config["sort"]):
-            assert isinstance(line, str)
-            if re.fullmatch(line.strip(), check):
+        for index, cre in enumerate(config["sort"]):
+            if cre.fullmatch(check):
                 return f"{index:04d}-{check}"
     if check.startswith("insn_"):
         return f"9999-{check}"
     return f"9998-{check}"
 
 
+def jobs_count(value: str) -> int:
+    jobs = int(value)
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f"expected 0 or more jobs, got {jobs}")
+    return jobs
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(
@@ -976,34 +1201,49 @@ if __name__ == "__main__":
     parser.add_argument(
         "--cfgname",
         type=str,
+        default=CFGNAME,
         help=f"name of the relative path to the destination directory [Default = {CFGNAME}]",
     )
     parser.add_argument(
         "--basedir",
         type=str,
+        default=BASEDIR,
         help=f"path to all checks in the rvfi library [Default = {BASEDIR}]",
     )
+    parser.add_argument(
+        "--jobs",
+        type=jobs_count,
+        default=1,
+        help=f"number of worker processes used to generate the checks, 0 uses one per cpu [Default = 1]",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"keep the existing destination directory and only rewrite the sby files that changed, the results of previous sby runs are still removed",
+    )
     args = parser.parse_args()
-    path = PathConfig(args.corename)
-    if args.cfgname:
-        path.cfgname  = args.cfgname
-    if args.basedir:
-        path.basedir  = args.basedir
+    path = PathConfig(args.corename, cfgname=args.cfgname, basedir=args.basedir, incremental=args.incremental)
 
     print(f"Entering {path.corename} directory")
-    os.chdir(os.path.abspath(path.corename))
+    os.chdir(path.corename)
 
     print(f"Creating {path.cfgname} directory.")
-    shutil.rmtree(path.cfgname, ignore_errors=True)
-    os.mkdir(path.cfgname)
+    if path.incremental:
+        os.makedirs(path.cfgname, exist_ok=True)
+    else:
+        shutil.rmtree(path.cfgname, ignore_errors=True)
+        os.mkdir(path.cfgname)
 
     config = parse_cfg(path.cfgname)
     isa_cfg, solver_cfg = extract_options(config)
     add_all_csrs(config, isa_cfg)
     hargs = init_hargs(config, isa_cfg, solver_cfg, path)
 
-    inst_checks = add_all_check_insn(config, hargs, isa_cfg, solver_cfg, path)
-    cons_checks = add_all_consistency_checks(config, hargs, isa_cfg, solver_cfg, path)
+    inst_checks = add_all_check_insn(config, hargs, isa_cfg, solver_cfg, path, args.jobs)
+    cons_checks = add_all_consistency_checks(config, hargs, isa_cfg, solver_cfg, path, args.jobs)
+
+    if path.incremental:
+        remove_stale_checks(path, cons_checks | inst_checks)
 
     create_makefile(config, solver_cfg, path, cons_checks, inst_checks)
 